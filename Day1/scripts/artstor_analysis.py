@@ -1,8 +1,41 @@
 # !/usr/bin/env python
 import sys
 from argparse import ArgumentParser
+from collections import Counter
+from multiprocessing import Pool
+import io
 import json
+import os
+import re
 import objectpath
+import fieldstats
+from fieldstats import FieldStats
+import querytable
+from readahead import compression, open_input
+import runmetrics
+from statscache import StatsCache
+
+# JSON whitespace, skipped between tokens of the top level export object.
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# Names of JSON Lines exports, compressed or not.
+JSONL_NAME = re.compile(r'\.jsonl(\.(gz|bz2|xz))?$')
+
+# An element argument made only of dotted field names, e.g.
+# Photographer.display_value, can be resolved without objectpath. Names
+# objectpath reads as operators or literals are left to objectpath.
+FIELD_PATH = re.compile(r'^[A-Za-z_]\w*(\.[A-Za-z_]\w*)*$')
+OBJECTPATH_WORDS = set(["and", "or", "not", "in", "is", "matches", "true",
+                        "t", "false", "f", "none", "null", "n", "nil"])
+
+# Element arguments already turned into queries, shared by every record.
+QUERIES = {}
+
+# Field paths interned to integer ids. FIELD_IDS maps (parent id, key) to
+# the id of the child path and FIELD_NAMES maps an id back to its dotted
+# path, so each path string is only built the first time it is seen.
+FIELD_IDS = {}
+FIELD_NAMES = []
 
 
 class RepoInvestigatorException(Exception):
@@ -25,17 +58,110 @@ class RepoInvestigatorException(Exception):
         return "%s" % (self.value,)
 
 
+def compiled_query(element):
+    """Get the query for an element argument, building it only once.
+
+    Returns the list of field names for a plain field path, which
+    find_field_path resolves directly, otherwise the objectpath query.
+    """
+    query = QUERIES.get(element)
+    if query is None:
+        fields = element.split(".")
+        if FIELD_PATH.match(element) and not [
+                field for field in fields
+                if field.lower() in OBJECTPATH_WORDS]:
+            query = fields
+        else:
+            query = '$..' + element
+        QUERIES[element] = query
+    return query
+
+
+def field_id(parent, field):
+    """Get the interned id of a field path.
+
+    Parent is the id of the enclosing path, or None at the top of a record.
+    List items get the field "[]", so they show up as e.g. "links[].source".
+    """
+    fid = FIELD_IDS.get((parent, field))
+    if fid is None:
+        if parent is None:
+            name = field
+        elif field == "[]":
+            name = FIELD_NAMES[parent] + field
+        else:
+            name = FIELD_NAMES[parent] + "." + field
+        fid = FIELD_IDS[(parent, field)] = len(FIELD_NAMES)
+        FIELD_NAMES.append(name)
+    return fid
+
+
+def find_field_path(obj, fields):
+    """Resolve a plain field path by walking the record directly.
+
+    Gives the same values, in the same order, as the objectpath query
+    '$..' + path: every value of the first field anywhere in the record
+    (non-empty lists spread out), then each further field looked up on
+    those.
+    """
+    first = fields[0]
+    out = []
+    stack = [obj]
+    while stack:
+        node = stack.pop()
+        if type(node) is dict:
+            if first in node:
+                value = node[first]
+                if type(value) is list and value:
+                    out.extend(value)
+                else:
+                    out.append(value)
+            stack.extend(reversed(list(node.values())))
+        elif type(node) is list:
+            stack.extend(reversed(node))
+    for field in fields[1:]:
+        out = [value[field] for value in out
+               if type(value) is dict and field in value]
+    return out
+
+
 class Record:
-    """Base class for an Artstor metadata record JSON Object."""
+    """Base class for an Artstor metadata record JSON Object.
+
+    One is made per record, so instances only hold the record's object and
+    its objectpath tree, if one is needed. Settings from the arguments are
+    shared by every record as class attributes, set once with configure.
+    """
+
+    __slots__ = ("obj", "_tree")
 
-    def __init__(self, obj, args):
+    # the element argument's query
+    element_query = None
+
+    def __init__(self, obj):
         """Object init.
 
         Object is the JSON property that stands in for an item level
-        'record'. Args contains all the arguments passed.
+        'record'.
         """
         self.obj = obj
-        self.args = args
+        self._tree = None
+
+    @classmethod
+    def configure(cls, args):
+        """Set the settings shared by every record from the arguments."""
+        cls.element_query = None
+        if args.element:
+            cls.element_query = compiled_query(args.element)
+
+    def query(self, element=None):
+        """Run an element query, by default the argument's, on this record."""
+        query = compiled_query(element) if element else self.element_query
+        if isinstance(query, list):
+            return find_field_path(self.obj, query)
+        if self._tree is None:
+            self._tree = objectpath.Tree(self.obj)
+        return list(self._tree.execute(query))
 
     def get_elements(self):
         """Get Element Values.
@@ -44,49 +170,64 @@ class Record:
         values.
         """
         out = []
-        tree = objectpath.Tree(self.obj)
-        resp = list(tree.execute('$..' + self.args.element))
+        resp = self.query()
         if resp and resp is not []:
             out = resp
         if len(out) == 0:
             out = None
-        self.elements = out
-        return self.elements
+        return out
+
+    def element_values(self, element):
+        """Get the values of an element query as a list of strings.
 
-    def get_stats(self):
+        Objects and lists found are given as JSON. Empty values are left
+        out.
+        """
+        out = []
+        for value in self.query(element):
+            if value is None or value == "":
+                continue
+            if isinstance(value, (dict, list)):
+                value = json.dumps(value, sort_keys=True)
+            out.append(str(value))
+        return out
+
+    def get_stats(self, values=None):
         """Get Field Usage Staistics.
 
         When no arguments passed, this is run to get all possible fields
-        containing text and generate field statistics from this.
+        containing text and generate field statistics from this. An empty
+        list or object counts as a use of its own field, as it always has.
+        If a values dictionary is passed, each field's values are added to
+        it as well.
         """
-        stats = {}
-        for field, value in self.obj.items():
-            if isinstance(value, dict):
-                for field2, value2 in value.items():
-                    if isinstance(value2, dict):
-                        for field3, value3 in value2.items():
-                            if isinstance(value3, dict):
-                                for field4, value4 in value3.items():
-                                    if value4:
-                                        stats.setdefault(field + "." + field2 +
-                                                         "." + field3 + "." +
-                                                         field4, 0)
-                                        stats[field + "." + field2 + "." +
-                                              field3 + "." + field4] += 1
-                            else:
-                                if value and value2 and value3:
-                                    stats.setdefault(field + "." + field2 +
-                                                     "." + field3, 0)
-                                    stats[field + "." + field2 + "." + field3] += 1
-                    else:
-                        if value is not None and value2 is not None:
-                            stats.setdefault(field + "." + field2, 0)
-                            stats[field + "." + field2] += 1
-            else:
-                if value is not None:
-                    stats.setdefault(field, 0)
-                    stats[field] += 1
-        return stats
+        counts = Counter()
+        found = {} if values is not None else None
+        stack = [(None, self.obj)]
+        while stack:
+            parent, value = stack.pop()
+            if type(value) is dict:
+                for field, child in value.items():
+                    stack.append((field_id(parent, field), child))
+                if not value and parent is not None:
+                    counts[parent] += 1
+            elif type(value) is list:
+                list_id = field_id(parent, "[]")
+                for child in value:
+                    stack.append((list_id, child))
+                if not value:
+                    counts[parent] += 1
+            elif value is not None and value != "":
+                counts[parent] += 1
+                if found is not None:
+                    text = str(value).strip()
+                    if text:
+                        found.setdefault(parent, []).append(text)
+        if found:
+            for fid, field_values in found.items():
+                values[FIELD_NAMES[fid]] = field_values
+        return dict((FIELD_NAMES[fid], count)
+                    for fid, count in counts.items())
 
     def has_element(self):
         """Check if an element is present.
@@ -95,84 +236,355 @@ class Record:
         this evaluates the objectpath and returns true/false if not None.
         """
         present = False
-        tree = objectpath.Tree(self.obj)
-        resp = list(tree.execute('$..' + self.args.element))
+        resp = self.query()
         if resp:
             present = True
             return present
 
 
-def collect_stats(stats_agg, stats):
+def iter_records(data, chunk_size=65536):
+    """Stream records from an Artstor JSON export.
+
+    The export is one top level object keyed by record id. Rather than
+    loading all of it, read the file in chunks and yield (key, record) pairs
+    one at a time, so only about one record is held in memory.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    # what the next token should be: "{", "key", ":", "value" or ","
+    expect = "{"
+    while True:
+        pos = WHITESPACE.match(buf, pos).end()
+        if pos == len(buf):
+            if eof:
+                raise RepoInvestigatorException("Unexpected end of JSON data")
+            buf = data.read(chunk_size)
+            eof = not buf
+            pos = 0
+            continue
+
+        char = buf[pos]
+        if expect == "{":
+            if char != "{":
+                raise RepoInvestigatorException("Data is not a JSON object")
+            pos += 1
+            expect = "key"
+        elif expect == ":":
+            if char != ":":
+                raise RepoInvestigatorException("Expected ':' at %d" % pos)
+            pos += 1
+            expect = "value"
+        elif char == "}" and expect in ("key", ","):
+            return
+        elif expect == ",":
+            if char != ",":
+                raise RepoInvestigatorException("Expected ',' at %d" % pos)
+            pos += 1
+            expect = "key"
+        else:
+            # decode a whole key or record, reading more when it is cut off
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                end = None
+            if end is None or (end == len(buf) and not eof):
+                if eof:
+                    raise RepoInvestigatorException("Invalid JSON at %d" % pos)
+                # at least double what is buffered, so a large record is
+                # not re-decoded once per chunk
+                buf = buf[pos:]
+                chunk = data.read(max(chunk_size, len(buf)))
+                eof = not chunk
+                buf += chunk
+                pos = 0
+                continue
+            pos = end
+            if expect == "key":
+                key = value
+                expect = ":"
+            else:
+                yield key, value
+                expect = ","
+
+
+def is_jsonl(datafile):
+    """Tell whether a datafile is JSON Lines, from its name."""
+    return JSONL_NAME.search(datafile) is not None
+
+
+def iter_jsonl_records(data, start=0, end=None):
+    """Stream records from an Artstor export converted to JSON Lines.
+
+    Each line is one record, with its key under "id" (see
+    artstorjsonl.py). Data is opened in binary. Given a byte range, only
+    the records whose lines start within it are read, so a file can be
+    split between processes at arbitrary offsets. Without one, data is
+    only read through, so it needn't be seekable.
+    """
+    if start:
+        # go to the first line starting at or after start
+        data.seek(start - 1)
+        data.readline()
+    pos = None if end is None else data.tell()
+    for line in data:
+        if pos is not None:
+            if pos >= end:
+                return
+            pos += len(line)
+        if line.strip():
+            value = json.loads(line.decode("utf-8"))
+            yield value.pop("id"), value
+
+
+def iter_datafile(datafile):
+    """Stream (key, record) pairs from an export, JSON or JSON Lines.
+
+    A gzip, bz2 or xz compressed export is decompressed as it is read.
+    """
+    with open_input(datafile) as data:
+        if is_jsonl(datafile):
+            records = iter_jsonl_records(data)
+        else:
+            records = iter_records(io.TextIOWrapper(data, encoding="utf-8"))
+        for key, value in records:
+            yield key, value
+
+
+def jsonl_ranges(datafile, count):
+    """Split a JSON Lines file into count byte ranges of about equal size."""
+    size = os.path.getsize(datafile)
+    step = max(1, -(-size // count))
+    return [(start, min(start + step, size))
+            for start in range(0, size, step)]
+
+
+def jsonl_batches(datafile, batch_size=500):
+    """Read lines of a compressed JSON Lines file in batches."""
+    with open_input(datafile) as data:
+        batch = []
+        for line in data:
+            batch.append(line)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def analyze_part(job):
+    """Worker: analyze part of a JSON Lines export.
+
+    Job is (args, part), where part is a (start, end) byte range of the
+    datafile or a batch of lines. Returns the part's statistics, its
+    printed output and its record count.
+    """
+    args, part = job
+    Record.configure(args)
+    stats_agg = FieldStats(args.cooccurrence is not None,
+                           values=args.values)
+    out = io.StringIO()
+    table = None
+    if args.table:
+        table = querytable.QueryTable(args.table, fmt=args.format,
+                                      present=args.present, stream=out,
+                                      header=False)
+    metrics = runmetrics.Metrics()
+    if isinstance(part, tuple):
+        with open(args.datafile, "rb") as data:
+            analyze_records(args, metrics, stats_agg, table=table,
+                            records=iter_jsonl_records(data, *part),
+                            out=out, progress=False)
+    else:
+        lines = io.BytesIO(b"".join(part))
+        analyze_records(args, metrics, stats_agg, table=table,
+                        records=iter_jsonl_records(lines),
+                        out=out, progress=False)
+    return stats_agg, out.getvalue(), metrics.records
+
+
+def parallel_analyze(args, metrics, stats_agg, table, workers):
+    """Analyze a JSON Lines export across a pool of worker processes.
+
+    A plain file is split into byte ranges that workers read for
+    themselves; a compressed one is read here and sent out in batches of
+    lines. Output comes back in file order and statistics are merged into
+    stats_agg.
+    """
+    if compression(args.datafile):
+        parts = jsonl_batches(args.datafile)
+    else:
+        # enough ranges that the output held for each one stays small
+        count = max(workers * 4,
+                    os.path.getsize(args.datafile) // (16 * 1024 * 1024))
+        parts = jsonl_ranges(args.datafile, count)
+    pool = Pool(workers)
+    try:
+        for partial, output, records in pool.imap(
+                analyze_part, ((args, part) for part in parts)):
+            metrics.records += records
+            metrics.mark("evaluate")
+            merge_stats(stats_agg, partial)
+            metrics.mark("aggregate")
+            if table is not None:
+                table.out.write(output)
+            else:
+                sys.stdout.write(output)
+            metrics.mark("output")
+            if args.stats is True and args.element is None:
+                sys.stderr.write("%d records processed\n" %
+                                 stats_agg.record_count)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def record_stats(record, values=False):
+    """Get a record's field usage statistics, with its values if asked.
+
+    Returns a (stats, values) pair; values is None unless asked for.
+    """
+    if not values:
+        return record.get_stats(), None
+    found = {}
+    return record.get_stats(found), found
+
+
+def collect_stats(stats_agg, stats, values=None):
     """Collect field usage statistics.
 
-    The following methods are all for taking a dictionary of field usage
-    statistics and generate the overall assessment output.
+    The following methods are all for taking a record's field usage
+    statistics and generate the overall assessment output. Stats_agg is a
+    FieldStats, which adds up records a batch at a time in NumPy columns,
+    and profiles the record's values too if they are given.
     """
-    # increment the record counter
-    stats_agg["record_count"] += 1
-
-    for field in stats:
-        # get the total number of times a field occurs
-        stats_agg["field_info"].setdefault(field, {"field_count": 0})
-        stats_agg["field_info"][field]["field_count"] += 1
-
-        # get average of all fields
-        stats_agg["field_info"][field].setdefault("field_count_total", 0)
-        stats_agg["field_info"][field]["field_count_total"] += stats[field]
-
-
-def create_stats_averages(stats_agg):
-    """Generate field averages for field usage statistics output."""
-    for field in stats_agg["field_info"]:
-        field_count = stats_agg["field_info"][field]["field_count"]
-        field_count_total = stats_agg["field_info"][field]["field_count_total"]
-
-        field_count_total_average = (float(field_count_total) /
-                                     float(stats_agg["record_count"]))
-        stats_agg["field_info"][field]["field_count_total_average"] = field_count_total_average
-
-        field_count_element_average = (float(field_count_total) / float(field_count))
-        stats_agg["field_info"][field]["field_count_element_average"] = field_count_element_average
-
-    return stats_agg
-
-
-def pretty_print_stats(stats_averages):
-    """Print the field usage statistics and averages."""
-    record_count = stats_averages["record_count"]
-    # get header length
-    element_length = 0
-    for element in stats_averages["field_info"]:
-        if element_length < len(element):
-            element_length = len(element)
-
-    print("\n\n")
-    for element in sorted(stats_averages["field_info"]):
-        percent = (stats_averages["field_info"][element]["field_count"] /
-                   float(record_count)) * 100
-        percentPrint = "=" * (int((percent) / 4))
-        columnOne = " " * (element_length - len(element)) + element
-        print("%s: |%-25s| %6s/%s | %3d%% " % (
-                    columnOne,
-                    percentPrint,
-                    stats_averages["field_info"][element]["field_count"],
-                    record_count,
-                    percent
-                ))
+    stats_agg.add(stats, values)
+
+
+def merge_stats(stats_agg, partial):
+    """Merge field usage statistics.
+
+    Adds partial statistics, as built by collect_stats in a worker, into
+    the overall ones. Counts only ever get summed, so merging gives the
+    same totals as a serial run.
+    """
+    stats_agg.merge(partial)
+
+
+def analyze(args, metrics):
+    """Run the analysis the arguments ask for, recording metrics."""
+    # start the field usage statistics that will be used later.
+    stats_agg = FieldStats(args.cooccurrence is not None,
+                           values=args.values)
+    Record.configure(args)
+
+    cache = None
+    if args.stats is True and args.element is None and args.cache:
+        cache = StatsCache(args.cache)
+    table = None
+    if args.table:
+        table = querytable.QueryTable(args.table, args.output, args.format,
+                                      args.present)
+    try:
+        if args.workers > 1:
+            parallel_analyze(args, metrics, stats_agg, table, args.workers)
+        else:
+            analyze_records(args, metrics, stats_agg, cache, table)
+    except BaseException:
+        if cache is not None:
+            cache.close(evict=False)
+        raise
+    finally:
+        if table is not None:
+            table.close()
+    if cache is not None:
+        sys.stderr.write("stats cache: %d hits, %d misses\n" %
+                         (cache.hits, cache.misses))
+        cache.close()
+
+    if args.stats is True and args.element is None:
+        fieldstats.report_stats(args, stats_agg)
+        metrics.mark("output")
+
+
+def analyze_records(args, metrics, stats_agg, cache=None, table=None,
+                    records=None, out=None, progress=True):
+    """Stream the records, printing elements or collecting statistics.
+
+    With a query table, every query is answered for each record in the
+    same pass, alongside the statistics if those were asked for too.
+    Records are read from the datafile unless given; printed lines go to
+    out, by default stdout.
+    """
+    if records is None:
+        records = iter_datafile(args.datafile)
+    # what to do with each record is the same for all of them
+    print_elements = args.stats is False and args.present is False and \
+        args.element
+    print_present = args.stats is False and args.present is True and \
+        args.element
+    get_stats = args.stats is True and args.element is None
+    s = 0
+    for key, value in records:
+        metrics.mark("parse")
+        metrics.count()
+        record = Record(value)
+        record_id = str(value['project_id']) + "_" + str(key)
+        metrics.mark("record")
+
+        if table is not None:
+            values = [record.element_values(element)
+                      for element in args.table]
+            metrics.mark("evaluate")
+            table.write(record_id, values)
+            metrics.mark("output")
+
+        if print_elements:
+            elements = record.get_elements()
+            metrics.mark("evaluate")
+            if elements is not None:
+                for i in elements:
+                    if args.id:
+                        if i:
+                            print("\t" + record_id + str(i), file=out)
+                    else:
+                        if i:
+                            print(str(i).encode('utf8'), file=out)
+            metrics.mark("output")
+
+        if print_present:
+            present = record.has_element()
+            metrics.mark("evaluate")
+            print("%s %s" % (record_id, present), file=out)
+            metrics.mark("output")
+
+        if get_stats:
+            if progress and (s % 1000) == 0 and s != 0:
+                sys.stderr.write("%d records processed\n" % s)
+            s += 1
+            if cache is not None:
+                # value profiles are cached apart from plain stats
+                content = json.dumps(value, sort_keys=True)
+                if args.values:
+                    content = "values\n" + content
+                stats, values = cache.get_stats(
+                    record_id, content.encode("utf-8"),
+                    lambda: record_stats(record, args.values))
+            else:
+                stats, values = record_stats(record, args.values)
+            metrics.mark("evaluate")
+            collect_stats(stats_agg, stats, values)
+            metrics.mark("aggregate")
 
 
 def main():
     """Main operation of script."""
-    # start the field usage statistics dictionary that will be used later.
-    stats_agg = {
-        "record_count": 0,
-        "field_info": {}
-    }
-
     # CLI arguments.
     parser = ArgumentParser(usage='%(prog)s [options] data_filename.json')
-    parser.add_argument("-e", "--element", dest="element",
-                        help="element to print to screen")
+    parser.add_argument("-e", "--element", dest="element", action="append",
+                        help="element to print to screen; repeat for a "
+                             "table of several")
     parser.add_argument("-i", "--id", action="store_true", dest="id",
                         default=False, help="prepend meta_id to line")
     parser.add_argument("-s", "--stats", action="store_true", dest="stats",
@@ -180,7 +592,17 @@ def main():
     parser.add_argument("-p", "--present", action="store_true",
                         dest="present", default=False,
                         help="print if there is value of element in record")
-    parser.add_argument("datafile", help="datafile you want analyzed")
+    parser.add_argument("-c", "--cache", dest="cache",
+                        help="per-record stats cache, reused across runs")
+    parser.add_argument("-w", "--workers", dest="workers", type=int,
+                        default=1,
+                        help="worker processes, for JSON Lines input")
+    fieldstats.add_arguments(parser)
+    querytable.add_arguments(parser)
+    runmetrics.add_arguments(parser)
+    parser.add_argument("datafile", help="datafile you want analyzed, JSON "
+                                         "or JSON Lines (.jsonl), optionally "
+                                         "gzip, bz2 or xz compressed")
 
     args = parser.parse_args()
 
@@ -188,39 +610,27 @@ def main():
         parser.print_help()
         exit()
 
-    if args.element is None:
-        args.stats = True
-
-    s = 0
-    with open(args.datafile) as data:
-        artstordata = json.load(data)
-
-    for key, value in artstordata.items():
-        record = Record(value, args)
-        record_id = str(value['project_id']) + "_" + str(key)
+    # one element prints its values as before; several make a table
+    queries = querytable.read_queries(args.element, args.queries)
+    args.table = None
+    args.element = None
+    if len(queries) > 1 or args.queries:
+        args.table = queries
+    elif queries:
+        args.element = queries[0]
 
-        if args.stats is False and args.present is False:
-            if record.get_elements() is not None:
-                for i in record.get_elements():
-                    if args.id:
-                        if i:
-                            print("\t" + record_id + str(i))
-                    else:
-                        if i:
-                            print(str(i).encode('utf8'))
-
-        if args.stats is False and args.present is True:
-            print("%s %s" % (record_id, record.has_element()))
+    if args.element is None and not args.table:
+        args.stats = True
 
-        if args.stats is True and args.element is None:
-            if (s % 1000) == 0 and s != 0:
-                print("%d records processed" % s)
-            s += 1
-            collect_stats(stats_agg, record.get_stats())
+    if args.table and args.stats and args.output is None:
+        parser.error("--stats with several queries needs --output")
+    if args.workers > 1 and not is_jsonl(args.datafile):
+        parser.error("--workers needs JSON Lines input; convert the export "
+                     "with artstorjsonl.py")
+    if args.cache and args.workers > 1:
+        parser.error("--cache can't be used with --workers")
 
-    if args.stats is True and args.element is None:
-        stats_averages = create_stats_averages(stats_agg)
-        pretty_print_stats(stats_averages)
+    runmetrics.run(analyze, args)
 
 if __name__ == "__main__":
     main()
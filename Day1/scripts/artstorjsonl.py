@@ -0,0 +1,51 @@
+# !/usr/bin/env python
+import gzip
+import io
+import json
+import sys
+from argparse import ArgumentParser
+from artstor_analysis import RepoInvestigatorException, iter_records
+from readahead import open_input
+
+
+def convert(datafile, output):
+    """Stream the records of an export into a JSON Lines file.
+
+    The export is one object keyed by record id, which can only be read
+    from the start. As JSON Lines, one record per line with its key under
+    "id", it can be split at any byte offset, so artstor_analysis.py -w
+    can spread it across processes. The export may be gzip, bz2 or xz
+    compressed, and the output is gzip-compressed if its name ends in .gz.
+    Returns the number of records written.
+    """
+    opener = gzip.open if output.endswith(".gz") else open
+    count = 0
+    with open_input(datafile) as data, opener(output, "wb") as out:
+        for key, value in iter_records(io.TextIOWrapper(data,
+                                                        encoding="utf-8")):
+            if "id" in value:
+                raise RepoInvestigatorException("Record %s already has an "
+                                                "id field" % key)
+            record = {"id": key}
+            record.update(value)
+            out.write(json.dumps(record, separators=(",", ":"))
+                      .encode("utf-8"))
+            out.write(b"\n")
+            count += 1
+    return count
+
+
+def main():
+    """Main operation of script."""
+    parser = ArgumentParser(usage='%(prog)s data_filename.json '
+                                  'output.jsonl[.gz]')
+    parser.add_argument("datafile", help="Artstor JSON export")
+    parser.add_argument("output", help="JSON Lines file to write")
+
+    args = parser.parse_args()
+
+    count = convert(args.datafile, args.output)
+    sys.stderr.write("%d records written to %s\n" % (count, args.output))
+
+if __name__ == "__main__":
+    main()
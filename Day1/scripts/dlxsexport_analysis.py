@@ -1,8 +1,32 @@
 # !/usr/bin/env python
 import sys
 from argparse import ArgumentParser
+from itertools import chain
+from multiprocessing import Pool
 from lxml import etree
+import os
 import re
+from dlxsindex import RecordIndex, RecordIndexException, index_path
+from dlxsrecords import iter_records, needs_body
+import fieldstats
+from fieldstats import FieldStats
+import querytable
+import runmetrics
+from statscache import StatsCache
+
+# Field paths seen so far, keyed by (parent path, tag), and the stats key
+# for each path. Records repeat the same structure, so both stay small and
+# every record shares the same strings.
+PATHS = {}
+STATSKEYS = {}
+
+# XPath expressions compiled once and shared by every record.
+XPATHS = {}
+
+# Whether field statistics include the co-occurrence matrix and value
+# profiles; set in worker processes by set_stats_options.
+COOCCURRENCE = False
+VALUES = False
 
 
 class RepoInvestigatorException(Exception):
@@ -25,17 +49,52 @@ class RepoInvestigatorException(Exception):
         return "%s" % (self.value,)
 
 
+def compiled_xpath(expression):
+    """Get the compiled XPath for an expression, compiling it only once."""
+    xpath = XPATHS.get(expression)
+    if xpath is None:
+        try:
+            xpath = XPATHS[expression] = etree.XPath(expression)
+        except etree.XPathSyntaxError as e:
+            raise RepoInvestigatorException("Invalid XPath %s: %s" %
+                                            (expression, e))
+    return xpath
+
+
+def add_value(values, field, text):
+    """Add a field's text, stripped, to a record's values if not empty."""
+    text = text.strip()
+    if text:
+        values.setdefault(field, []).append(text)
+
+
 class Record:
-    """Base class for nested metadata record in a DLXS export."""
+    """Base class for nested metadata record in a DLXS export.
+
+    One is made per record, so instances only hold the record's element
+    and the result of its XPath. Settings from the arguments are shared
+    by every record as class attributes, set once with configure.
+    """
+
+    __slots__ = ("elem", "_xpath_result")
+
+    # the XPath argument, compiled, and the element argument
+    xpath = None
+    element = None
 
-    def __init__(self, elem, args):
+    def __init__(self, elem):
         """Record XML init.
 
-        Elem is the XML node that stands in for an item level 'record'. Args
-        contains all the arguments passed.
+        Elem is the XML node that stands in for an item level 'record'.
         """
         self.elem = elem
-        self.args = args
+        self._xpath_result = None
+
+    @classmethod
+    def configure(cls, args):
+        """Set the settings shared by every record from the arguments."""
+        cls.xpath = compiled_xpath(args.xpath) if args.xpath else None
+        cls.element = getattr(args, "element", None)
 
     def get_record_id(self):
         """Get Record Identifier."""
@@ -53,12 +112,17 @@ class Record:
         """
         out = []
         for desc in self.elem.iterdescendants():
-            if desc.tag == self.args.element and desc.text is not None:
+            if desc.tag == self.element and desc.text is not None:
                 out.append(desc.text.encode("utf-8").strip())
         if len(out) == 0:
             out = None
-        self.elements = out
-        return self.elements
+        return out
+
+    def xpath_result(self):
+        """Evaluate the XPath expression argument once for this record."""
+        if self._xpath_result is None:
+            self._xpath_result = self.xpath(self.elem)
+        return self._xpath_result
 
     def get_xpath(self):
         """Get XPath Values.
@@ -67,32 +131,80 @@ class Record:
         values.
         """
         out = []
-        if self.elem.xpath(self.args.xpath) is not None:
-            for value in self.elem.xpath(self.args.xpath):
-                if value.text is not None:
-                    out.append(value.text.encode("utf-8").strip())
+        for value in self.xpath_result():
+            if value.text is not None:
+                out.append(value.text.encode("utf-8").strip())
         if len(out) == 0:
             out = None
-        self.elements = out
-        return self.elements
+        return out
 
-    def get_stats(self):
+    def get_stats(self, values=None):
         """Get Field Usage Statistics.
 
         When no arguments passed, this is run to get all possible fields
-        containing text and generate field statistics from this.
+        containing text and generate field statistics from this. If a
+        values dictionary is passed, each field's text values are added to
+        it as well.
         """
         stats = {}
-        record = etree.ElementTree(self.elem)
-        for desc in self.elem.iterdescendants():
-            if len(desc) is 0 and desc.text is not None:
-                # ignore empties, does NOT have children elements
-                statskey = re.sub('\[\d+\]', '', record.getpath(desc))
+        record = None
+        # walk the record keeping the path of each element on the stack, so
+        # field paths come straight from the tags instead of getpath
+        stack = [(child, "/record") for child in reversed(self.elem)]
+        while stack:
+            desc, parent_path = stack.pop()
+            tag = desc.tag
+            if parent_path is not None and isinstance(tag, str) and \
+                    "{" not in tag:
+                path = PATHS.get((parent_path, tag))
+                if path is None:
+                    path = PATHS[(parent_path, tag)] = parent_path + "/" + tag
+                if len(desc):
+                    stack.extend((child, path) for child in reversed(desc))
+                    continue
+                if desc.text is not None:
+                    statskey = STATSKEYS.get(path)
+                    if statskey is None:
+                        statskey = STATSKEYS[path] = path.replace('/record/',
+                                                                  '')
+                    stats.setdefault(statskey, 0)
+                    stats[statskey] += 1
+                    if values is not None:
+                        add_value(values, statskey, desc.text)
+            elif len(desc):
+                stack.extend((child, None) for child in reversed(desc))
+            elif desc.text is not None:
+                # comments, PIs and namespaced tags: fall back to getpath
+                if record is None:
+                    record = etree.ElementTree(self.elem)
+                statskey = re.sub(r'\[\d+\]', '', record.getpath(desc))
                 statskey = statskey.replace('/record/', '')
                 stats.setdefault(statskey, 0)
                 stats[statskey] += 1
+                if values is not None:
+                    add_value(values, statskey, desc.text)
         return stats
 
+    def xpath_values(self, expression):
+        """Get the values of any XPath expression as a list of strings.
+
+        Elements give their text, and string, number or boolean results
+        are converted as they are. Empty values are left out.
+        """
+        result = compiled_xpath(expression)(self.elem)
+        if not isinstance(result, list):
+            result = [result]
+        out = []
+        for value in result:
+            if etree.iselement(value):
+                value = value.text
+            if value is None:
+                continue
+            value = str(value).strip()
+            if value:
+                out.append(value)
+        return out
+
     def has_xpath(self):
         """Check if an XPath expression value exists.
 
@@ -100,91 +212,262 @@ class Record:
         this evaluates the XPath and returns true/false if not None.
         """
         present = False
-        if self is not None:
-            if self.elem.xpath(self.args.xpath) is not None:
-                for value in self.elem.xpath(self.args.xpath):
-                    if value.text is not None:
-                        present = True
-                        return present
+        for value in self.xpath_result():
+            if value.text is not None:
+                present = True
+                return present
+
+
+def set_stats_options(cooccurrence, values):
+    """Worker initializer: say what the field statistics should include."""
+    global COOCCURRENCE, VALUES
+    COOCCURRENCE = cooccurrence
+    VALUES = values
 
 
-def collect_stats(stats_agg, stats):
+def record_stats(record):
+    """Get a record's field usage statistics, with its values if profiled.
+
+    Returns a (stats, values) pair; values is None unless VALUES is set.
+    """
+    if not VALUES:
+        return record.get_stats(), None
+    values = {}
+    return record.get_stats(values), values
+
+
+def collect_stats(stats_agg, stats, values=None):
     """Collect field usage statistics.
 
-    The following methods are all for taking a dictionary of field usage
-    statistics and generate the overall assessment output.
+    The following methods are all for taking a record's field usage
+    statistics and generate the overall assessment output. Stats_agg is a
+    FieldStats, which adds up records a batch at a time in NumPy columns,
+    and profiles the record's values too if they are given.
     """
-    # increment the record counter
-    stats_agg["record_count"] += 1
+    stats_agg.add(stats, values)
 
-    for field in stats:
-        # get the total number of times a field occurs
-        stats_agg["field_info"].setdefault(field, {"field_count": 0})
-        stats_agg["field_info"][field]["field_count"] += 1
 
-        # get average of all fields
-        stats_agg["field_info"][field].setdefault("field_count_total", 0)
-        stats_agg["field_info"][field]["field_count_total"] += stats[field]
+def merge_stats(stats_agg, partial):
+    """Merge field usage statistics.
 
+    Adds partial statistics, as built by collect_stats in a worker, into
+    the overall ones. Counts only ever get summed, so merging gives the
+    same totals as a serial run.
+    """
+    stats_agg.merge(partial)
 
-def create_stats_averages(stats_agg):
-    """Generate field averages for field usage statistics output."""
-    for field in stats_agg["field_info"]:
-        field_count = stats_agg["field_info"][field]["field_count"]
-        field_count_total = stats_agg["field_info"][field]["field_count_total"]
 
-        field_count_total_average = (float(field_count_total) /
-                                     float(stats_agg["record_count"]))
-        stats_agg["field_info"][field]["field_count_total_average"] = field_count_total_average
+def stats_for_file(datafile):
+    """Worker: collect field usage statistics for a whole export file."""
+    stats_agg = FieldStats(COOCCURRENCE, values=VALUES)
+    for elem in iter_records(datafile):
+        collect_stats(stats_agg, *record_stats(Record(elem)))
+    return stats_agg
 
-        field_count_element_average = (float(field_count_total) / float(field_count))
-        stats_agg["field_info"][field]["field_count_element_average"] = field_count_element_average
 
+def stats_for_records(records):
+    """Worker: collect field usage statistics for serialized records."""
+    stats_agg = FieldStats(COOCCURRENCE, values=VALUES)
+    for record in records:
+        collect_stats(stats_agg,
+                      *record_stats(Record(etree.fromstring(record))))
     return stats_agg
 
 
-def pretty_print_stats(stats_averages):
-    """Print the field usage statistics and averages."""
-    record_count = stats_averages["record_count"]
-    # get header length
-    element_length = 0
-    for element in stats_averages["field_info"]:
-        if element_length < len(element):
-            element_length = len(element)
-
-    print("\n\n")
-    for element in sorted(stats_averages["field_info"]):
-        percent = (stats_averages["field_info"][element]["field_count"] /
-                   float(record_count)) * 100
-        percentPrint = "=" * (int((percent) / 4))
-        columnOne = " " * (element_length - len(element)) + element
-        print("%s: |%-25s| %6s/%s | %3d%% " % (
-                    columnOne,
-                    percentPrint,
-                    stats_averages["field_info"][element]["field_count"],
-                    record_count,
-                    percent
-                ))
+def stats_for_shard(shard):
+    """Worker: collect field usage statistics for a run of indexed records.
+
+    Shard is (datafile, first seq, last seq); the worker reads those
+    records straight from the export using its index.
+    """
+    datafile, first, last = shard
+    stats_agg = FieldStats(COOCCURRENCE, values=VALUES)
+    index = RecordIndex(datafile)
+    try:
+        for elem in index.iter_records(first, last):
+            collect_stats(stats_agg, *record_stats(Record(elem)))
+    finally:
+        index.close()
+    return stats_agg
+
+
+def serialized_records(datafiles, batch_size=200):
+    """Read records from export files in batches of serialized XML."""
+    for datafile in datafiles:
+        batch = []
+        for elem in iter_records(datafile):
+            batch.append(etree.tostring(elem))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def parallel_stats(stats_agg, datafiles, workers):
+    """Collect field usage statistics across a pool of worker processes.
+
+    With several export files each worker takes whole files. A single file
+    indexed with dlxsindex.py is split into byte-balanced runs of records
+    that workers read for themselves; otherwise, or if the index is out of
+    date, it is parsed here and sent out in batches of records. Each
+    worker returns its own partial statistics, which are merged into
+    stats_agg.
+    """
+    shards = None
+    if len(datafiles) == 1 and os.path.exists(index_path(datafiles[0])):
+        try:
+            index = RecordIndex(datafiles[0])
+        except RecordIndexException as e:
+            sys.stderr.write("%s; reading it without the index\n" % e)
+        else:
+            shards = [(datafiles[0], first, last)
+                      for first, last in index.shards(workers * 4)]
+            index.close()
+    pool = Pool(workers, set_stats_options, (COOCCURRENCE, VALUES))
+    try:
+        if len(datafiles) > 1:
+            partials = pool.imap_unordered(stats_for_file, datafiles)
+        elif shards is not None:
+            partials = pool.imap_unordered(stats_for_shard, shards)
+        else:
+            partials = pool.imap_unordered(stats_for_records,
+                                           serialized_records(datafiles))
+        for partial in partials:
+            merge_stats(stats_agg, partial)
+            sys.stderr.write("%d records processed\n" %
+                             stats_agg.record_count)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def analyze(args, metrics):
+    """Run the analysis the arguments ask for, recording metrics."""
+    set_stats_options(args.cooccurrence is not None, args.values)
+    # start the field usage statistics that will be used later.
+    stats_aggregate = FieldStats(COOCCURRENCE, values=VALUES)
+    Record.configure(args)
+
+    if args.stats and args.xpath is None and args.workers > 1:
+        parallel_stats(stats_aggregate, args.datafile, args.workers)
+        metrics.records = stats_aggregate.record_count
+        metrics.mark("aggregate")
+        fieldstats.report_stats(args, stats_aggregate)
+        metrics.mark("output")
+        return
+
+    cache = None
+    if args.stats and args.xpath is None and args.cache:
+        cache = StatsCache(args.cache)
+    table = None
+    if args.table:
+        table = querytable.QueryTable(args.table, args.output, args.format,
+                                      args.present)
+    try:
+        analyze_records(args, metrics, stats_aggregate, cache, table)
+    except BaseException:
+        if cache is not None:
+            cache.close(evict=False)
+        raise
+    finally:
+        if table is not None:
+            table.close()
+    if cache is not None:
+        sys.stderr.write("stats cache: %d hits, %d misses\n" %
+                         (cache.hits, cache.misses))
+        cache.close()
+
+    if args.stats and args.xpath is None:
+        fieldstats.report_stats(args, stats_aggregate)
+        metrics.mark("output")
+
+
+def analyze_records(args, metrics, stats_aggregate, cache=None, table=None):
+    """Stream the records, printing values or collecting statistics.
+
+    With a query table, every query is answered for each record in the
+    same pass, alongside the statistics if those were asked for too.
+    """
+    # the TEXT page structure is only dropped when nothing will look at it
+    skip_body = args.stats is False and not [
+        expr for expr in (args.table or [args.xpath]) if needs_body(expr)]
+    # what to do with each record is the same for all of them
+    print_values = args.stats is False and args.present is False and \
+        args.xpath
+    print_present = args.stats is False and args.xpath and args.present
+    get_stats = args.stats and args.xpath is None
+    s = 0
+    for elem in chain.from_iterable(iter_records(datafile, skip_body)
+                                    for datafile in args.datafile):
+        metrics.mark("parse")
+        metrics.count()
+        r = Record(elem)
+        record_id = r.get_record_id()
+        metrics.mark("record")
+
+        if table is not None:
+            values = [r.xpath_values(expr) for expr in args.table]
+            metrics.mark("evaluate")
+            table.write(record_id, values)
+            metrics.mark("output")
+
+        if print_values:
+            values = r.get_xpath()
+            metrics.mark("evaluate")
+            if values is not None:
+                for i in values:
+                    if args.id:
+                        print("\t".join([record_id, str(i)]))
+                    else:
+                        print(i)
+            metrics.mark("output")
+
+        if print_present:
+            present = r.has_xpath()
+            metrics.mark("evaluate")
+            print("%s %s" % (record_id, present))
+            metrics.mark("output")
+
+        if get_stats:
+            if (s % 1000) == 0 and s != 0:
+                sys.stderr.write("%d records processed\n" % s)
+            s += 1
+            if cache is not None:
+                # value profiles are cached apart from plain stats
+                content = etree.tostring(elem)
+                if VALUES:
+                    content = b"values\n" + content
+                stats, values = cache.get_stats(record_id, content,
+                                                lambda: record_stats(r))
+            else:
+                stats, values = record_stats(r)
+            metrics.mark("evaluate")
+            collect_stats(stats_aggregate, stats, values)
+            metrics.mark("aggregate")
 
 
 def main():
     """Main operation of script."""
-    # start the field usage statistics dictionary that will be used later.
-    stats_aggregate = {
-        "record_count": 0,
-        "field_info": {}
-    }
-
     parser = ArgumentParser(usage='%(prog)s [options] data_filename.xml')
-    parser.add_argument("-x", "--xpath", dest="xpath",
-                        help="get response of xpath expression on record")
+    parser.add_argument("-x", "--xpath", dest="xpath", action="append",
+                        help="get response of xpath expression on record; "
+                             "repeat for a table of several")
     parser.add_argument("-i", "--id", action="store_true", dest="id",
                         default=False, help="prepend meta_id to line")
     parser.add_argument("-s", "--stats", action="store_true", dest="stats",
                         default=False, help="only print stats for repository")
     parser.add_argument("-p", "--present", action="store_true", dest="present",
                         default=False, help="print if element is in record")
-    parser.add_argument("datafile", help="datafile you want analyzed")
+    parser.add_argument("-w", "--workers", dest="workers", type=int,
+                        default=1, help="worker processes for stats")
+    parser.add_argument("-c", "--cache", dest="cache",
+                        help="per-record stats cache, reused across runs")
+    fieldstats.add_arguments(parser)
+    querytable.add_arguments(parser)
+    runmetrics.add_arguments(parser)
+    parser.add_argument("datafile", nargs="+",
+                        help="datafile(s) you want analyzed")
 
     args = parser.parse_args()
 
@@ -192,36 +475,26 @@ def main():
         parser.print_help()
         exit()
 
-    if args.xpath is None:
+    # one XPath prints its values as before; several make a table
+    queries = querytable.read_queries(args.xpath, args.queries)
+    args.table = None
+    args.xpath = None
+    if len(queries) > 1 or args.queries:
+        args.table = queries
+    elif queries:
+        args.xpath = queries[0]
+
+    if args.xpath is None and not args.table:
         args.stats = True
 
-    s = 0
-    for event, elem in etree.iterparse(args.datafile):
-        if elem.tag == "record":
-            r = Record(elem, args)
-            record_id = r.get_record_id()
-
-            if args.stats is False and args.present is False and args.xpath:
-                if r.get_xpath() is not None:
-                    for i in r.get_xpath():
-                        if args.id:
-                            print("\t".join([record_id, str(i)]))
-                        else:
-                            print(i)
-
-            if args.stats is False and args.xpath and args.present:
-                print("%s %s" % (record_id, r.has_xpath()))
-
-            if args.stats and args.xpath is None:
-                if (s % 1000) == 0 and s != 0:
-                    print("%d records processed" % s)
-                s += 1
-                collect_stats(stats_aggregate, r.get_stats())
-            elem.clear()
+    if args.cache and args.workers > 1:
+        parser.error("--cache can't be used with --workers")
+    if args.table and args.workers > 1:
+        parser.error("--workers is only for stats without queries")
+    if args.table and args.stats and args.output is None:
+        parser.error("--stats with several queries needs --output")
 
-    if args.stats and args.xpath is None:
-        stats_averages = create_stats_averages(stats_aggregate)
-        pretty_print_stats(stats_averages)
+    runmetrics.run(analyze, args)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,210 @@
+# !/usr/bin/env python
+import sys
+from argparse import ArgumentParser
+from lxml import etree
+import mmap
+import os
+import sqlite3
+from readahead import compression
+
+
+class RecordIndexException(Exception):
+    """This is our base exception for this script."""
+
+    def __init__(self, value):
+        """Exception Object init.
+
+        Returns exception value if exception occurs.
+        """
+        self.value = value
+
+    def __str__(self):
+        """String value of exception.
+
+        Returns exception value as string.
+        """
+        return "%s" % (self.value,)
+
+
+def index_path(datafile):
+    """Get the sidecar index path for a DLXS export."""
+    return datafile + ".idx"
+
+
+def scan_records(data):
+    """Find the byte range of every <record> in a DLXS export.
+
+    Works on the raw bytes, so it assumes "<record" and "</record>" do not
+    appear inside comments or CDATA. Yields (offset, length) pairs.
+    """
+    start = data.find(b"<record")
+    while start != -1:
+        after = data[start + 7:start + 8]
+        if after not in (b">", b" ", b"\t", b"\n", b"\r"):
+            start = data.find(b"<record", start + 7)
+            continue
+        end = data.find(b"</record>", start)
+        if end == -1:
+            raise RecordIndexException("Unclosed <record> at byte %d" % start)
+        end += len(b"</record>")
+        yield start, end - start
+        start = data.find(b"<record", end)
+
+
+def build_index(datafile, path=None):
+    """Index a DLXS export.
+
+    Writes a SQLite sidecar listing the IDNO, byte offset and length of each
+    <record>, in file order. Returns the number of records indexed.
+    Compressed exports can't be read at an offset, so can't be indexed.
+    """
+    fmt = compression(datafile)
+    if fmt:
+        raise RecordIndexException("%s is %s compressed; decompress it to "
+                                   "index it" % (datafile, fmt))
+    path = path or index_path(datafile)
+    if os.path.exists(path):
+        os.remove(path)
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE meta (size INTEGER, mtime REAL)")
+    db.execute("CREATE TABLE records (seq INTEGER PRIMARY KEY, id TEXT, "
+               "offset INTEGER, length INTEGER)")
+    stat = os.stat(datafile)
+    db.execute("INSERT INTO meta VALUES (?, ?)", (stat.st_size,
+                                                  stat.st_mtime))
+    count = 0
+    with open(datafile, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            rows = []
+            for offset, length in scan_records(data):
+                elem = etree.fromstring(data[offset:offset + length])
+                record_id = elem.findtext("FILEDESC/PUBLICATIONSTMT/IDNO")
+                rows.append((count, record_id, offset, length))
+                count += 1
+                if len(rows) == 10000:
+                    db.executemany("INSERT INTO records VALUES (?, ?, ?, ?)",
+                                   rows)
+                    rows = []
+            db.executemany("INSERT INTO records VALUES (?, ?, ?, ?)", rows)
+        finally:
+            data.close()
+    db.execute("CREATE INDEX records_id ON records (id)")
+    db.commit()
+    db.close()
+    return count
+
+
+class RecordIndex:
+    """Random access to the records of an indexed DLXS export."""
+
+    def __init__(self, datafile, path=None):
+        """Open the export and its index.
+
+        Raises RecordIndexException if there is no index, or if the export
+        has changed since it was indexed.
+        """
+        path = path or index_path(datafile)
+        if not os.path.exists(path):
+            raise RecordIndexException("%s is not indexed" % datafile)
+        self.db = sqlite3.connect(path)
+        size, mtime = self.db.execute("SELECT size, mtime FROM meta").fetchone()
+        stat = os.stat(datafile)
+        if stat.st_size != size or stat.st_mtime != mtime:
+            self.db.close()
+            raise RecordIndexException("Index of %s is out of date" %
+                                       datafile)
+        self.file = open(datafile, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.db.execute("SELECT count(*) FROM records").fetchone()[0]
+
+    def lookup(self, record_id):
+        """Get the (offset, length) of a record, or None if not indexed."""
+        return self.db.execute("SELECT offset, length FROM records "
+                               "WHERE id = ?", (record_id,)).fetchone()
+
+    def record_bytes(self, offset, length):
+        """Get the raw XML of the record at a byte range."""
+        return self.data[offset:offset + length]
+
+    def get_record(self, record_id):
+        """Parse a single record by IDNO, or return None if not indexed."""
+        found = self.lookup(record_id)
+        if found is None:
+            return None
+        return etree.fromstring(self.record_bytes(*found))
+
+    def shards(self, count):
+        """Split the records into count runs of about equal bytes.
+
+        Returns a list of (first seq, last seq) pairs, in file order.
+        """
+        total = self.db.execute("SELECT sum(length) FROM records").fetchone()[0]
+        shards = []
+        first = None
+        seen = 0
+        for seq, length in self.db.execute("SELECT seq, length FROM records "
+                                           "ORDER BY seq"):
+            if first is None:
+                first = seq
+            seen += length
+            if seen * count >= total * (len(shards) + 1):
+                shards.append((first, seq))
+                first = None
+        if first is not None:
+            shards.append((first, seq))
+        return shards
+
+    def iter_records(self, first=0, last=None):
+        """Parse the records from seq first to last, in file order."""
+        if last is None:
+            last = len(self) - 1
+        rows = self.db.execute("SELECT offset, length FROM records WHERE seq "
+                               "BETWEEN ? AND ? ORDER BY seq", (first, last))
+        for offset, length in rows:
+            yield etree.fromstring(self.record_bytes(offset, length))
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+        self.db.close()
+
+
+def main():
+    """Main operation of script."""
+    parser = ArgumentParser(usage='%(prog)s [options] data_filename.xml')
+    parser.add_argument("-l", "--lookup", dest="lookup",
+                        help="print the record with this IDNO")
+    parser.add_argument("-s", "--shards", dest="shards", type=int,
+                        help="print seq ranges for this many even shards")
+    parser.add_argument("datafile", help="datafile you want indexed")
+
+    args = parser.parse_args()
+
+    try:
+        if args.lookup is None and args.shards is None:
+            count = build_index(args.datafile)
+            print("%d records indexed in %s" % (count,
+                                                index_path(args.datafile)))
+            return
+        index = RecordIndex(args.datafile)
+    except RecordIndexException as e:
+        sys.exit(str(e))
+
+    try:
+        if args.lookup is not None:
+            found = index.lookup(args.lookup)
+            if found is None:
+                sys.exit("%s not found" % args.lookup)
+            sys.stdout.write(index.record_bytes(*found).decode("utf-8"))
+            sys.stdout.write("\n")
+        if args.shards is not None:
+            for first, last in index.shards(args.shards):
+                print("%d\t%d" % (first, last))
+    finally:
+        index.close()
+
+if __name__ == "__main__":
+    main()
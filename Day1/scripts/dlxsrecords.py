@@ -0,0 +1,62 @@
+# !/usr/bin/env python
+from lxml import etree
+import re
+from readahead import open_compressed
+
+# Plain child paths into a record's header sections, the only queries
+# known not to look at its TEXT section.
+HEADER_XPATH = re.compile(r'^(FILEDESC|ENCODINGDESC|PROFILEDESC)'
+                          r'(/[A-Za-z_][\w.-]*)*(/@[A-Za-z_][\w.-]*|'
+                          r'/text\(\))?$')
+
+
+def needs_body(xpath):
+    """Check if an XPath expression may need a record's TEXT section.
+
+    Errs on the side of True: only plain paths into the header sections,
+    like FILEDESC/SOURCEDESC/BIBL/AUTHOR, are known not to. Anything else,
+    such as string-length(.), may read the whole record.
+    """
+    return xpath is None or HEADER_XPATH.match(xpath.strip()) is None
+
+
+def iter_records(source, skip_body=False):
+    """Stream the <record> elements of a DLXS export.
+
+    Only record end events reach Python, rather than one per element. Each
+    record is cleared, and detached from the <collection> root along with
+    any earlier siblings, once the caller moves on to the next one, so
+    memory stays flat however large the export. With skip_body, each
+    record's TEXT section (the DIV1/PB page structure) is dropped as soon
+    as it has been parsed.
+
+    A gzip, bz2 or xz compressed export is decompressed as it is read, in
+    a thread of its own when there is a CPU to spare.
+    """
+    data = None
+    if isinstance(source, str):
+        data = open_compressed(source)
+    try:
+        for elem in parse_records(source if data is None else data,
+                                  skip_body):
+            yield elem
+    finally:
+        if data is not None:
+            data.close()
+
+
+def parse_records(source, skip_body):
+    """Do the iterparse for iter_records."""
+    tags = ("record", "TEXT") if skip_body else ("record",)
+    for event, elem in etree.iterparse(source, tag=tags):
+        if elem.tag == "TEXT":
+            parent = elem.getparent()
+            if parent is not None and parent.tag == "record":
+                parent.remove(elem)
+            continue
+        yield elem
+        elem.clear()
+        parent = elem.getparent()
+        if parent is not None:
+            while elem.getprevious() is not None:
+                del parent[0]
@@ -0,0 +1,391 @@
+# !/usr/bin/env python
+import csv
+import hashlib
+from collections import Counter
+import numpy
+
+# Histogram bins for the number of times a field occurs in a record: 0, 1,
+# 2, ... with the last bin taking that many or more.
+HISTOGRAM_BINS = 11
+
+# HyperLogLog registers per field are 2 ** HLL_BITS bytes; 12 bits gives
+# distinct counts within about 1.6%.
+HLL_BITS = 12
+HLL_REGISTERS = 1 << HLL_BITS
+HLL_ALPHA = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+
+# Values counted per field for the top values, and how many are shown.
+TOP_CAPACITY = 64
+TOP_SHOWN = 5
+
+
+def value_hash(value):
+    """Hash a value to a 64 bit integer for HyperLogLog."""
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"),
+                                          digest_size=8).digest(), "little")
+
+
+def bit_length(x):
+    """Get the bit length of each number in an array of uint64."""
+    length = numpy.zeros(len(x), numpy.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        big = x >= numpy.uint64(1 << shift)
+        length[big] += shift
+        x = numpy.where(big, x >> numpy.uint64(shift), x)
+    length += (x > 0).astype(numpy.uint8)
+    return length
+
+
+def merge_top(top, counts):
+    """Merge value counts into a field's top values summary.
+
+    Top is a Misra-Gries summary of at most TOP_CAPACITY values. Merging
+    adds the counts together and, past capacity, takes the count of the
+    first value that doesn't fit off every value, dropping those left at
+    nothing. A count is then never more than the true count, nor short of
+    it by more than the field's total values / (TOP_CAPACITY + 1), however
+    the values were split up and merged.
+    """
+    top.update(counts)
+    if len(top) > TOP_CAPACITY:
+        cut = sorted(top.values(), reverse=True)[TOP_CAPACITY]
+        for value in list(top):
+            top[value] -= cut
+            if top[value] <= 0:
+                del top[value]
+    return top
+
+
+class FieldStats:
+    """Field usage statistics accumulated column-wise in NumPy arrays.
+
+    Each field gets a column index the first time it is seen. Per-record
+    stats are buffered and added a batch at a time, summing how many
+    records have each field, its total occurrences, a histogram of its
+    occurrences per record and, if asked for, how often each pair of
+    fields appears in the same record.
+
+    With values, each field's values are also profiled in bounded memory:
+    a HyperLogLog sketch estimates how many distinct values it has, and a
+    Misra-Gries summary finds its most common ones. Both merge exactly
+    across shards.
+    """
+
+    def __init__(self, cooccurrence=False, batch_size=1000, values=False):
+        self.columns = {}
+        self.fields = []
+        self.record_count = 0
+        self.batch_size = batch_size
+        self.rows = []
+        self.cols = []
+        self.counts = []
+        self.pending = 0
+        self.field_count = numpy.zeros(0, numpy.int64)
+        self.field_count_total = numpy.zeros(0, numpy.int64)
+        self.histogram = numpy.zeros((0, HISTOGRAM_BINS), numpy.int64)
+        self.cooccurrence = None
+        if cooccurrence:
+            self.cooccurrence = numpy.zeros((0, 0), numpy.int64)
+        self.registers = None
+        self.top = None
+        if values:
+            self.registers = numpy.zeros((0, HLL_REGISTERS), numpy.uint8)
+            self.value_total = numpy.zeros(0, numpy.int64)
+            self.top = []
+            self.batch_values = {}
+
+    def __getstate__(self):
+        # workers hand their statistics back pickled, so add the last
+        # partial batch first
+        self.flush()
+        return self.__dict__
+
+    def column(self, field):
+        """Get the column index of a field, giving it one if it is new."""
+        col = self.columns.get(field)
+        if col is None:
+            col = self.columns[field] = len(self.fields)
+            self.fields.append(field)
+        return col
+
+    def add(self, stats, values=None):
+        """Add one record's stats, a dictionary of field to occurrences.
+
+        Values, when profiling them, is a dictionary of field to the list
+        of the record's values for it.
+        """
+        column = self.column
+        self.rows.extend([self.pending] * len(stats))
+        for field, count in stats.items():
+            self.cols.append(column(field))
+            self.counts.append(count)
+        if values and self.top is not None:
+            for field, field_values in values.items():
+                col = column(field)
+                counts = self.batch_values.get(col)
+                if counts is None:
+                    counts = self.batch_values[col] = Counter()
+                counts.update(field_values)
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def grow(self):
+        """Widen the arrays to cover every field seen so far."""
+        extra = len(self.fields) - len(self.field_count)
+        if extra <= 0:
+            return
+        self.field_count = numpy.concatenate(
+            (self.field_count, numpy.zeros(extra, numpy.int64)))
+        self.field_count_total = numpy.concatenate(
+            (self.field_count_total, numpy.zeros(extra, numpy.int64)))
+        self.histogram = numpy.concatenate(
+            (self.histogram, numpy.zeros((extra, HISTOGRAM_BINS),
+                                         numpy.int64)))
+        if self.cooccurrence is not None:
+            self.cooccurrence = numpy.pad(self.cooccurrence,
+                                          ((0, extra), (0, extra)),
+                                          "constant")
+        if self.registers is not None:
+            self.registers = numpy.concatenate(
+                (self.registers, numpy.zeros((extra, HLL_REGISTERS),
+                                             numpy.uint8)))
+            self.value_total = numpy.concatenate(
+                (self.value_total, numpy.zeros(extra, numpy.int64)))
+            self.top.extend(Counter() for i in range(extra))
+
+    def flush(self):
+        """Add the buffered records to the totals."""
+        if not self.pending:
+            return
+        self.grow()
+        n = len(self.fields)
+        cols = numpy.array(self.cols, numpy.int64)
+        counts = numpy.array(self.counts, numpy.int64)
+        # a field appears at most once in a record's stats
+        self.field_count += numpy.bincount(cols, minlength=n)
+        self.field_count_total += numpy.bincount(
+            cols, weights=counts, minlength=n).astype(numpy.int64)
+        bins = numpy.minimum(counts, HISTOGRAM_BINS - 1)
+        self.histogram += numpy.bincount(
+            cols * HISTOGRAM_BINS + bins,
+            minlength=n * HISTOGRAM_BINS).reshape(n, HISTOGRAM_BINS)
+        if self.cooccurrence is not None:
+            present = numpy.zeros((self.pending, n))
+            present[numpy.array(self.rows, numpy.int64), cols] = 1.0
+            self.cooccurrence += numpy.dot(present.T,
+                                           present).astype(numpy.int64)
+        if self.registers is not None:
+            self.flush_values()
+        self.record_count += self.pending
+        self.rows = []
+        self.cols = []
+        self.counts = []
+        self.pending = 0
+
+    def flush_values(self):
+        """Add the buffered records' values to the sketches.
+
+        Each distinct value in the batch is hashed once. The first
+        HLL_BITS bits of its hash pick a register, which keeps the highest
+        position of the first 1 bit seen in the rest.
+        """
+        cols = []
+        hashes = []
+        for col, counts in self.batch_values.items():
+            merge_top(self.top[col], counts)
+            self.value_total[col] += sum(counts.values())
+            cols.extend([col] * len(counts))
+            hashes.extend(value_hash(value) for value in counts)
+        self.batch_values = {}
+        if not hashes:
+            return
+        hashes = numpy.array(hashes, numpy.uint64)
+        register = (hashes >> numpy.uint64(64 - HLL_BITS)).astype(numpy.int64)
+        rest = hashes & numpy.uint64((1 << (64 - HLL_BITS)) - 1)
+        rank = (64 - HLL_BITS + 1) - bit_length(rest)
+        numpy.maximum.at(self.registers.reshape(-1),
+                         numpy.array(cols, numpy.int64) * HLL_REGISTERS +
+                         register, rank)
+
+    def distinct(self):
+        """Estimate the number of distinct values of every field at once."""
+        self.flush()
+        registers = self.registers.astype(numpy.float64)
+        estimate = HLL_ALPHA * HLL_REGISTERS ** 2 / numpy.sum(
+            numpy.power(2.0, -registers), axis=1)
+        # small counts are better estimated from the empty registers
+        empty = numpy.sum(self.registers == 0, axis=1)
+        small = (estimate <= 2.5 * HLL_REGISTERS) & (empty > 0)
+        estimate[small] = HLL_REGISTERS * numpy.log(
+            float(HLL_REGISTERS) / empty[small])
+        return estimate
+
+    def merge(self, other):
+        """Add another FieldStats, e.g. from a worker, into this one."""
+        self.flush()
+        other.flush()
+        index = numpy.array([self.column(field) for field in other.fields],
+                            numpy.int64)
+        self.grow()
+        self.record_count += other.record_count
+        if not len(index):
+            return
+        self.field_count[index] += other.field_count
+        self.field_count_total[index] += other.field_count_total
+        self.histogram[index] += other.histogram
+        if self.cooccurrence is not None and other.cooccurrence is not None:
+            self.cooccurrence[numpy.ix_(index, index)] += other.cooccurrence
+        if self.registers is not None and other.registers is not None:
+            self.registers[index] = numpy.maximum(self.registers[index],
+                                                  other.registers)
+            self.value_total[index] += other.value_total
+            for col, top in zip(index, other.top):
+                merge_top(self.top[col], top)
+
+    def averages(self):
+        """Get the totals and averages in the usual stats dictionary shape.
+
+        The averages are worked out for all fields at once, giving the
+        dictionary pretty_print_stats reports from. When values are
+        profiled, each field also has its estimated distinct values and
+        its top values with their (lower bound) counts. Values counted no
+        more than the summary's error margin are left out, since they may
+        only be there because of how the records were split up.
+        """
+        self.flush()
+        total = self.field_count_total.astype(numpy.float64)
+        total_average = total / float(self.record_count or 1)
+        element_average = total / numpy.maximum(self.field_count, 1)
+        if self.registers is not None:
+            distinct = self.distinct()
+        field_info = {}
+        for col, field in enumerate(self.fields):
+            field_info[field] = {
+                "field_count": int(self.field_count[col]),
+                "field_count_total": int(self.field_count_total[col]),
+                "field_count_total_average": float(total_average[col]),
+                "field_count_element_average": float(element_average[col])
+            }
+            if self.registers is not None:
+                field_info[field]["distinct"] = int(round(distinct[col]))
+                margin = self.value_total[col] / float(TOP_CAPACITY + 1)
+                top = Counter(dict((value, count) for value, count
+                                   in self.top[col].items()
+                                   if count > margin))
+                field_info[field]["top_values"] = top.most_common(TOP_SHOWN)
+        return {"record_count": self.record_count, "field_info": field_info}
+
+    def histograms(self):
+        """Get each field's histogram of occurrences per record.
+
+        Bin 0 counts the records without the field, which can't be summed
+        as records go by since a field may first turn up late.
+        """
+        self.flush()
+        histogram = self.histogram.copy()
+        histogram[:, 0] = self.record_count - self.field_count
+        return histogram
+
+    def write_cooccurrence(self, path):
+        """Write the field co-occurrence matrix as CSV, fields sorted."""
+        self.flush()
+        order = sorted(range(len(self.fields)), key=self.fields.__getitem__)
+        matrix = self.cooccurrence[numpy.ix_(order, order)]
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f, lineterminator="\n")
+            writer.writerow([""] + [self.fields[col] for col in order])
+            for row, col in enumerate(order):
+                writer.writerow([self.fields[col]] +
+                                [int(value) for value in matrix[row]])
+
+
+def add_arguments(parser):
+    """Add the field statistics report options to a script's parser."""
+    parser.add_argument("-v", "--values", action="store_true", dest="values",
+                        default=False,
+                        help="also estimate distinct values and find the "
+                             "top values of each field")
+    parser.add_argument("--histogram", action="store_true", dest="histogram",
+                        default=False,
+                        help="also print occurrences per record of each "
+                             "field")
+    parser.add_argument("--cooccurrence", dest="cooccurrence", default=None,
+                        metavar="FILE.csv",
+                        help="write how often each pair of fields share a "
+                             "record")
+
+
+def report_stats(args, field_stats):
+    """Print the field usage statistics and any extra reports asked for."""
+    pretty_print_stats(field_stats.averages())
+    if args.histogram:
+        pretty_print_histograms(field_stats)
+    if args.cooccurrence:
+        field_stats.write_cooccurrence(args.cooccurrence)
+
+
+def pretty_print_stats(stats_averages):
+    """Print the field usage statistics and averages."""
+    record_count = stats_averages["record_count"]
+    # get header length
+    element_length = max([len(element) for element in
+                          stats_averages["field_info"]] or [0])
+
+    print("\n\n")
+    for element in sorted(stats_averages["field_info"]):
+        percent = (stats_averages["field_info"][element]["field_count"] /
+                   float(record_count)) * 100
+        percentPrint = "=" * (int((percent) / 4))
+        columnOne = " " * (element_length - len(element)) + element
+        line = "%s: |%-25s| %6s/%s | %3d%% " % (
+                    columnOne,
+                    percentPrint,
+                    stats_averages["field_info"][element]["field_count"],
+                    record_count,
+                    percent
+                )
+        pretty_print_field(line, stats_averages["field_info"][element],
+                           element_length)
+
+
+def shorten(value, width=40):
+    """Shorten a value for printing on one line."""
+    value = " ".join(value.split())
+    if len(value) > width:
+        value = value[:width - 3] + "..."
+    return value
+
+
+def pretty_print_field(line, info, width):
+    """Print a field's line of the stats report, with its value profile.
+
+    When values were profiled, the line also gives the field's estimated
+    number of distinct values and is followed by a line, indented by
+    width, of its top values with counts (which may be a little low).
+    """
+    if "distinct" not in info:
+        print(line)
+        return
+    print("%s| ~%d distinct" % (line, info["distinct"]))
+    if info["top_values"]:
+        print("%s  top: %s" % (" " * width, ", ".join(
+            "%s (%d)" % (shorten(value), count)
+            for value, count in info["top_values"])))
+
+
+def pretty_print_histograms(field_stats):
+    """Print how many records have each field 0, 1, 2, ... times."""
+    histogram = field_stats.histograms()
+    width = max([len(field) for field in field_stats.fields] or [0])
+    labels = [str(i) for i in range(HISTOGRAM_BINS - 1)]
+    labels.append("%d+" % (HISTOGRAM_BINS - 1))
+    print("\n\n")
+    print("%s  %s" % (" " * width,
+                      " ".join("%7s" % label for label in labels)))
+    for col in sorted(range(len(field_stats.fields)),
+                      key=field_stats.fields.__getitem__):
+        field = field_stats.fields[col]
+        print("%s: %s" % (" " * (width - len(field)) + field,
+                          " ".join("%7d" % count
+                                   for count in histogram[col])))
@@ -0,0 +1,76 @@
+# !/usr/bin/env python
+import csv
+import sys
+
+
+def add_arguments(parser):
+    """Add the query file and table output options to a script's parser."""
+    parser.add_argument("-q", "--queries", dest="queries", default=None,
+                        metavar="FILE",
+                        help="file of queries, one per line, answered in "
+                             "the same pass")
+    parser.add_argument("-f", "--format", dest="format", default="tsv",
+                        choices=["tsv", "csv"],
+                        help="table format when there are several queries")
+    parser.add_argument("-o", "--output", dest="output", default=None,
+                        help="write the table to a file instead of stdout")
+
+
+def read_queries(queries, query_file=None):
+    """Gather the queries given as repeated options and in a query file.
+
+    The file has one query per line. Blank lines and lines starting with #
+    are skipped.
+    """
+    out = list(queries or [])
+    if query_file is not None:
+        with open(query_file) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    out.append(line)
+    return out
+
+
+class QueryTable:
+    """Answers to several queries, one row per record and column per query.
+
+    The first column is the record id. A query with several values for a
+    record has them joined with "|"; with present set, each cell is just
+    True or False. Rows go to the output file, to stream if one is given
+    (as workers do, leaving out the header), or else to stdout.
+    """
+
+    def __init__(self, queries, output=None, fmt="tsv", present=False,
+                 stream=None, header=True):
+        self.present = present
+        if stream is not None:
+            self.out = stream
+            self.close_out = False
+        elif output is None:
+            self.out = sys.stdout
+            self.close_out = False
+        else:
+            self.out = open(output, "w", newline="")
+            self.close_out = True
+        if fmt == "csv":
+            self.writer = csv.writer(self.out, lineterminator="\n")
+        else:
+            self.writer = csv.writer(self.out, delimiter="\t",
+                                     lineterminator="\n")
+        if header:
+            self.writer.writerow(["id"] + list(queries))
+
+    def write(self, record_id, values):
+        """Write a record's row, given a list of values for each query."""
+        if self.present:
+            cells = [str(bool(value)) for value in values]
+        else:
+            cells = ["|".join(value) for value in values]
+        self.writer.writerow([record_id] + cells)
+
+    def close(self):
+        if self.close_out:
+            self.out.close()
+        else:
+            self.out.flush()
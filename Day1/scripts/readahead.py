@@ -0,0 +1,141 @@
+# !/usr/bin/env python
+import bz2
+import gzip
+import io
+import lzma
+import os
+import queue
+import threading
+
+# Leading bytes of each compressed format, and how to open it.
+MAGIC = [
+    (b"\x1f\x8b", "gzip", gzip.open),
+    (b"BZh", "bz2", bz2.open),
+    (b"\xfd7zXZ\x00", "xz", lzma.open)
+]
+
+
+def spare_cpu():
+    """Tell whether this process can run on more than one CPU.
+
+    With only one, a read-ahead thread can't decompress while the parser
+    works, and only adds the cost of switching between them.
+    """
+    try:
+        return len(os.sched_getaffinity(0)) > 1
+    except AttributeError:
+        return (os.cpu_count() or 1) > 1
+
+
+def compressed_format(path):
+    """Get the MAGIC entry matching a file's first bytes, or None."""
+    with open(path, "rb") as f:
+        head = f.read(6)
+    for entry in MAGIC:
+        if head.startswith(entry[0]):
+            return entry
+    return None
+
+
+def compression(path):
+    """Tell whether a file is compressed, from its first bytes.
+
+    Returns "gzip", "bz2" or "xz", or None for anything else.
+    """
+    entry = compressed_format(path)
+    return entry[1] if entry else None
+
+
+class ReadAhead(io.RawIOBase):
+    """Read a file through a background thread that stays ahead.
+
+    The thread reads chunks from raw into a bounded queue, so while the
+    caller parses one chunk the next ones are already being read. zlib,
+    bz2 and lzma let go of the GIL while they decompress, so for a
+    compressed file decompression and parsing run side by side.
+    """
+
+    def __init__(self, raw, chunk_size=1 << 20, depth=8):
+        self.raw = raw
+        self.queue = queue.Queue(depth)
+        self.stop = threading.Event()
+        self.error = None
+        self.chunk = memoryview(b"")
+        self.pos = 0
+        self.eof = False
+        self.thread = threading.Thread(target=self.fill, args=(chunk_size,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def fill(self, chunk_size):
+        """Thread: read chunks into the queue until the end of the file."""
+        try:
+            while not self.stop.is_set():
+                chunk = self.raw.read(chunk_size)
+                self.put(chunk)
+                if not chunk:
+                    return
+        except Exception as e:
+            self.error = e
+            self.put(b"")
+
+    def put(self, chunk):
+        # wait for room, unless the reader has been closed
+        while not self.stop.is_set():
+            try:
+                self.queue.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.pos == len(self.chunk):
+            if self.eof:
+                return 0
+            self.chunk = memoryview(self.queue.get())
+            self.pos = 0
+            if not len(self.chunk):
+                self.eof = True
+                if self.error is not None:
+                    raise self.error
+                return 0
+        n = min(len(b), len(self.chunk) - self.pos)
+        b[:n] = self.chunk[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.stop.set()
+            self.thread.join()
+            self.raw.close()
+        io.RawIOBase.close(self)
+
+
+def open_compressed(path, readahead=None):
+    """Open a gzip, bz2 or xz file to read it decompressed, in binary.
+
+    Decompression runs in a ReadAhead thread if readahead is True, or by
+    default when there is a spare CPU for it. Returns None if the file
+    isn't compressed, so the caller can read it directly.
+    """
+    entry = compressed_format(path)
+    if entry is None:
+        return None
+    data = entry[2](path, "rb")
+    if readahead is None:
+        readahead = spare_cpu()
+    if not readahead:
+        return data
+    return io.BufferedReader(ReadAhead(data), 1 << 16)
+
+
+def open_input(path, readahead=None):
+    """Open a possibly compressed file to read it in binary."""
+    data = open_compressed(path, readahead)
+    if data is None:
+        data = open(path, "rb")
+    return data
@@ -0,0 +1,116 @@
+# !/usr/bin/env python
+import cProfile
+import json
+import sys
+import time
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss_mb():
+    """Get this process's peak RSS in MB, or None if it can't be told.
+
+    VmHWM is preferred where there is one, as on Linux ru_maxrss also
+    counts the memory of the parent process at the time it forked.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.0
+    except IOError:
+        pass
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+class Metrics:
+    """Per-phase timing, throughput and memory use of an analysis run.
+
+    Calling mark(phase) charges the time since the previous mark to that
+    phase. When metrics are off, mark and count do nothing.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.phases = {}
+        self.records = 0
+        self.start = self.last = time.time()
+
+    def mark(self, phase):
+        """Charge the time since the last mark to phase."""
+        if self.enabled:
+            now = time.time()
+            self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last
+            self.last = now
+
+    def count(self):
+        """Count a processed record."""
+        self.records += 1
+
+    def summary(self):
+        """Get the metrics gathered so far as a dictionary."""
+        elapsed = time.time() - self.start
+        summary = {
+            "records": self.records,
+            "seconds": elapsed,
+            "records_per_sec": self.records / elapsed if elapsed else 0.0,
+            "phases": self.phases
+        }
+        peak = peak_rss_mb()
+        if peak is not None:
+            summary["peak_rss_mb"] = peak
+        return summary
+
+    def report(self, destination):
+        """Write the metrics to stderr ("-") or as JSON to a file."""
+        summary = self.summary()
+        if destination != "-":
+            with open(destination, "w") as f:
+                json.dump(summary, f, indent=2, sort_keys=True)
+            return
+        sys.stderr.write("%d records in %.2fs (%.0f records/sec)\n" % (
+            summary["records"], summary["seconds"],
+            summary["records_per_sec"]))
+        for phase in sorted(summary["phases"]):
+            sys.stderr.write("%12s: %8.2fs\n" % (phase,
+                                                 summary["phases"][phase]))
+        if "peak_rss_mb" in summary:
+            sys.stderr.write("   peak RSS: %8.1fMB\n" %
+                             summary["peak_rss_mb"])
+
+
+def add_arguments(parser):
+    """Add the --metrics and --profile options to a script's parser."""
+    parser.add_argument("--metrics", action="store_true", dest="metrics",
+                        default=False,
+                        help="report phase times, records/sec and peak "
+                             "memory to stderr")
+    parser.add_argument("--metrics-file", dest="metrics_file", default=None,
+                        metavar="FILE.json",
+                        help="write the --metrics report as JSON to a file")
+    parser.add_argument("--profile", dest="profile", default=None,
+                        metavar="FILE.prof",
+                        help="run under cProfile and dump stats to a file")
+
+
+def run(func, args):
+    """Run func(args, metrics) with the metrics and profiling asked for."""
+    destination = args.metrics_file or ("-" if args.metrics else None)
+    metrics = Metrics(destination is not None)
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        func(args, metrics)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+    if destination is not None:
+        metrics.report(destination)
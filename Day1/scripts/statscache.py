@@ -0,0 +1,60 @@
+# !/usr/bin/env python
+import hashlib
+import json
+import sqlite3
+
+
+class StatsCache:
+    """Per-record field usage statistics kept between runs, in SQLite.
+
+    Each record's statistics are stored under its id along with a hash of
+    its content. On the next run an unchanged record gets its statistics
+    back from the cache instead of having them worked out again. Records
+    not seen in a complete run are evicted when the cache is closed.
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS records (id TEXT "
+                        "PRIMARY KEY, digest BLOB, stats TEXT, run INTEGER)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (run INTEGER)")
+        row = self.db.execute("SELECT run FROM meta").fetchone()
+        if row is None:
+            self.run = 1
+            self.db.execute("INSERT INTO meta VALUES (1)")
+        else:
+            self.run = row[0] + 1
+            self.db.execute("UPDATE meta SET run = ?", (self.run,))
+        self.hits = 0
+        self.misses = 0
+
+    def get_stats(self, record_id, content, compute):
+        """Get a record's statistics, from the cache if it is unchanged.
+
+        Content is the record's serialized bytes; compute is called to get
+        the statistics when the cache has none for this content.
+        """
+        digest = hashlib.blake2b(content, digest_size=16).digest()
+        row = self.db.execute("SELECT digest, stats FROM records WHERE id = ?",
+                              (record_id,)).fetchone()
+        if row is not None and bytes(row[0]) == digest:
+            self.hits += 1
+            self.db.execute("UPDATE records SET run = ? WHERE id = ?",
+                            (self.run, record_id))
+            return json.loads(row[1])
+        self.misses += 1
+        stats = compute()
+        self.db.execute("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)",
+                        (record_id, digest, json.dumps(stats), self.run))
+        return stats
+
+    def close(self, evict=True):
+        """Save the cache, evicting records this run did not see.
+
+        Pass evict=False when the run stopped early, so records it never
+        reached are kept.
+        """
+        if evict:
+            self.db.execute("DELETE FROM records WHERE run != ?", (self.run,))
+        self.db.commit()
+        self.db.close()
@@ -0,0 +1,64 @@
+# !/usr/bin/env python
+"""Time streaming a compressed DLXS export, with and without read-ahead.
+
+Builds an export by repeating the records of a sample export, writes
+gzip, bz2 and xz copies of it, then streams each with
+dlxsrecords.iter_records, decompressing in the parsing thread and in a
+readahead.ReadAhead thread, and prints the time of each run. Read-ahead
+can only pay off when the process has more than one CPU.
+"""
+import bz2
+import gzip
+import lzma
+import os
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from iterparse_memory import SAMPLE, SCRIPTS, write_export
+
+sys.path.insert(0, SCRIPTS)
+
+from dlxsrecords import parse_records
+from readahead import open_compressed, spare_cpu
+
+OPENERS = [("gzip", ".gz", gzip.open), ("bz2", ".bz2", bz2.open),
+           ("xz", ".xz", lzma.open)]
+
+
+def stream(data):
+    """Stream every record of an open export, returning the seconds taken."""
+    start = time.time()
+    with data:
+        for elem in parse_records(data, False):
+            pass
+    return time.time() - start
+
+
+def main():
+    parser = ArgumentParser(usage='%(prog)s [options]')
+    parser.add_argument("-n", "--copies", dest="copies", type=int,
+                        default=50, help="times to repeat the sample records")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, "export.xml")
+        write_export(path, SAMPLE, args.copies)
+        print("%d MB export, spare CPU: %s" % (os.path.getsize(path) >> 20,
+                                                spare_cpu()))
+        print("%-6s %10s" % ("plain", "%.2fs" % stream(open(path, "rb"))))
+        for name, suffix, opener in OPENERS:
+            with open(path, "rb") as f, opener(path + suffix, "wb") as out:
+                shutil.copyfileobj(f, out)
+            direct = stream(open_compressed(path + suffix, readahead=False))
+            ahead = stream(open_compressed(path + suffix, readahead=True))
+            print("%-6s %10s %10s read-ahead" % (name, "%.2fs" % direct,
+                                                 "%.2fs" % ahead))
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
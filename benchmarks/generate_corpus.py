@@ -0,0 +1,82 @@
+# !/usr/bin/env python
+"""Scale a sample export up to a synthetic corpus of any size.
+
+DLXS XML exports (like hunt_books.xml) and Artstor JSON exports (like
+labor_photos.json) are both supported; the format is taken from the
+sample's extension. Records are drawn at random from the sample, so the
+corpus keeps its real shape, and each copy gets a unique id. Output is
+written as it is generated, so memory does not grow with the corpus.
+"""
+import json
+import os
+import random
+import re
+import sys
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "Day1", "scripts"))
+from dlxsindex import scan_records  # noqa: E402
+
+IDNO = re.compile(br'(<IDNO[^>]*>)([^<]*)(</IDNO>)')
+
+
+def generate_xml(sample, output, count, rng):
+    """Write a DLXS export of count records drawn from sample."""
+    with open(sample, "rb") as f:
+        data = f.read()
+    spans = list(scan_records(data))
+    records = [data[offset:offset + length] for offset, length in spans]
+    head = data[:spans[0][0]]
+    tail = data[spans[-1][0] + spans[-1][1]:]
+
+    with open(output, "wb") as out:
+        out.write(head)
+        for num in range(count):
+            record = rng.choice(records)
+            suffix = ("_%07d" % num).encode("ascii")
+            out.write(IDNO.sub(lambda m: m.group(1) + m.group(2) + suffix +
+                               m.group(3), record, count=1))
+            out.write(b"\n")
+        out.write(tail)
+    return count
+
+
+def generate_json(sample, output, count, rng):
+    """Write an Artstor export of count records drawn from sample."""
+    with open(sample) as f:
+        records = [json.dumps(value) for value in json.load(f).values()]
+
+    with open(output, "w") as out:
+        out.write("{")
+        for num in range(count):
+            if num:
+                out.write(", ")
+            out.write('"%d": %s' % (num + 1, rng.choice(records)))
+        out.write("}")
+    return count
+
+
+def generate(sample, output, count, seed=0):
+    """Write a corpus of count records drawn from sample to output."""
+    rng = random.Random(seed)
+    if sample.endswith(".json"):
+        return generate_json(sample, output, count, rng)
+    return generate_xml(sample, output, count, rng)
+
+
+def main():
+    parser = ArgumentParser(usage='%(prog)s [options] sample output')
+    parser.add_argument("-n", "--records", dest="records", type=int,
+                        default=100000, help="number of records to write")
+    parser.add_argument("--seed", dest="seed", type=int, default=0,
+                        help="random seed, for repeatable corpora")
+    parser.add_argument("sample", help="sample export (.xml or .json)")
+    parser.add_argument("output", help="where to write the corpus")
+    args = parser.parse_args()
+
+    count = generate(args.sample, args.output, args.records, args.seed)
+    print("%d records written to %s" % (count, args.output))
+
+if __name__ == "__main__":
+    main()
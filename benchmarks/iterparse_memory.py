@@ -0,0 +1,91 @@
+# !/usr/bin/env python
+"""Peak memory of streaming a DLXS export, across export sizes.
+
+Builds exports of increasing size by repeating the records of a sample
+export, then streams each one in a fresh process, both the old way
+(iterparse of every element, clearing only the record) and with
+dlxsrecords.iter_records, and prints each run's time and peak RSS. With
+iter_records the peak should stay flat as the export grows.
+"""
+import os
+import tempfile
+from argparse import ArgumentParser
+
+from peakrss import measure
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = os.path.join(HERE, "..", "Day1", "scripts")
+SAMPLE = os.path.join(HERE, "..", "Day1", "data", "hunt_books.xml")
+
+STREAMERS = {
+    "iterparse": """
+from lxml import etree
+for event, elem in etree.iterparse(sys.argv[1]):
+    if elem.tag == "record":
+        elem.clear()
+""",
+    "iter_records": """
+from dlxsrecords import iter_records
+for elem in iter_records(sys.argv[1]):
+    pass
+""",
+    "iter_records_skip_body": """
+from dlxsrecords import iter_records
+for elem in iter_records(sys.argv[1], skip_body=True):
+    pass
+"""
+}
+
+
+def write_export(path, sample, copies):
+    """Write an export holding every record of sample, copies times over."""
+    with open(sample, "rb") as f:
+        data = f.read()
+    start = data.index(b"<record")
+    end = data.rindex(b"</record>") + len(b"</record>")
+    records = data[start:end]
+    with open(path, "wb") as out:
+        out.write(data[:start])
+        for copy in range(copies):
+            out.write(records)
+            out.write(b"\n")
+        out.write(data[end:])
+
+
+def run(code, datafile):
+    """Run code in a fresh interpreter.
+
+    Returns the wall time in seconds and the peak RSS in MB.
+    """
+    code = "import sys\nsys.path.insert(0, %r)\n%s" % (SCRIPTS, code)
+    return measure(["-c", code, datafile])
+
+
+def main():
+    parser = ArgumentParser(usage='%(prog)s [options]')
+    parser.add_argument("-c", "--copies", dest="copies", type=int, nargs="+",
+                        default=[1, 4, 16],
+                        help="export sizes, in copies of the sample")
+    parser.add_argument("sample", nargs="?", default=SAMPLE,
+                        help="DLXS export to build the test exports from")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    print("%8s %10s %24s %10s %10s" % ("copies", "size MB", "streamer",
+                                       "seconds", "peak MB"))
+    try:
+        for copies in args.copies:
+            path = os.path.join(tmpdir, "export_%d.xml" % copies)
+            write_export(path, args.sample, copies)
+            size = os.path.getsize(path) / (1024.0 * 1024.0)
+            for name in ("iterparse", "iter_records",
+                         "iter_records_skip_body"):
+                elapsed, peak = run(STREAMERS[name], path)
+                print("%8d %10.1f %24s %10.2f %10.1f" % (copies, size, name,
+                                                         elapsed, peak))
+            os.remove(path)
+    finally:
+        os.rmdir(tmpdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# !/usr/bin/env python
+"""Run a Python script, or code with -c, and record its peak RSS.
+
+The script is run in this process, and once it finishes its peak RSS
+from runmetrics.peak_rss_mb is written to OUTFILE (in MB), rather than
+taking it from wait4() in a benchmark runner that may have grown.
+
+    python peakrss.py OUTFILE script.py [args...]
+    python peakrss.py OUTFILE -c CODE [args...]
+"""
+import os
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "Day1", "scripts"))
+
+from runmetrics import peak_rss_mb
+
+
+def measure(command, stdout=None):
+    """Run a script (or ["-c", code, ...]) in a fresh interpreter.
+
+    Returns its wall time in seconds and peak RSS in MB. Output goes to
+    stdout, by default /dev/null.
+    """
+    fd, outfile = tempfile.mkstemp(suffix=".peak")
+    os.close(fd)
+    devnull = open(os.devnull, "w")
+    try:
+        start = time.time()
+        status = subprocess.call([sys.executable, os.path.abspath(__file__),
+                                  outfile] + command,
+                                 stdout=stdout or devnull, stderr=devnull)
+        elapsed = time.time() - start
+        if status != 0:
+            raise RuntimeError("%s failed" % " ".join(command))
+        with open(outfile) as f:
+            return elapsed, float(f.read())
+    finally:
+        devnull.close()
+        os.remove(outfile)
+
+
+def main():
+    outfile = sys.argv[1]
+    try:
+        if sys.argv[2] == "-c":
+            code = sys.argv[3]
+            sys.argv = ["-c"] + sys.argv[4:]
+            exec(compile(code, "<string>", "exec"), {"__name__": "__main__"})
+        else:
+            sys.argv = sys.argv[2:]
+            sys.path.insert(0, os.path.dirname(os.path.abspath(sys.argv[0])))
+            runpy.run_path(sys.argv[0], run_name="__main__")
+    finally:
+        peak = peak_rss_mb()
+        with open(outfile, "w") as f:
+            f.write("nan" if peak is None else "%f" % peak)
+
+if __name__ == "__main__":
+    main()
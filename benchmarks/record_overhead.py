@@ -0,0 +1,94 @@
+# !/usr/bin/env python
+"""Per-record cost of the analysis scripts' Record objects.
+
+Makes a Record for each record of a sample export, over and over, and
+prints the time per record and the memory each instance takes. For
+comparison the same is done with a subclass that has an instance
+__dict__ and keeps the arguments and its results on itself, as Record
+used to.
+"""
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser, Namespace
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = os.path.join(HERE, "..", "Day1", "scripts")
+DATA = os.path.join(HERE, "..", "Day1", "data")
+sys.path.insert(0, SCRIPTS)
+
+import artstor_analysis
+import dlxsexport_analysis
+from lxml import etree
+
+
+class DictDlxsRecord(dlxsexport_analysis.Record):
+
+    def __init__(self, elem, args):
+        dlxsexport_analysis.Record.__init__(self, elem)
+        self.args = args
+        self.elements = None
+
+
+class DictArtstorRecord(artstor_analysis.Record):
+
+    def __init__(self, obj, args):
+        artstor_analysis.Record.__init__(self, obj)
+        self.args = args
+        self.elements = None
+
+
+def per_record(make, items, rounds):
+    """Time making a record for each item, and size the instances.
+
+    Returns microseconds per record and bytes per instance.
+    """
+    start = time.time()
+    for round in range(rounds):
+        for item in items:
+            make(item)
+    elapsed = time.time() - start
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    held = [make(item) for item in items]
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    # the list holding them isn't part of the records
+    size -= sys.getsizeof(held)
+    return (elapsed * 1e6 / (rounds * len(items)),
+            float(size) / len(items))
+
+
+def main():
+    parser = ArgumentParser(usage='%(prog)s [options]')
+    parser.add_argument("-r", "--rounds", dest="rounds", type=int,
+                        default=200, help="times to go over each sample")
+    args = parser.parse_args()
+
+    # iter_records clears each record once done with it, so parse it all
+    elems = etree.parse(os.path.join(DATA, "hunt_books.xml")).findall(
+        ".//record")
+    with open(os.path.join(DATA, "labor_photos.json")) as data:
+        objs = [value for key, value in artstor_analysis.iter_records(data)]
+    options = Namespace(xpath=None, element=None, stats=True)
+
+    cases = [
+        ("dlxs Record",
+         lambda elem: dlxsexport_analysis.Record(elem), elems),
+        ("dlxs with __dict__",
+         lambda elem: DictDlxsRecord(elem, options), elems),
+        ("artstor Record",
+         lambda obj: artstor_analysis.Record(obj), objs),
+        ("artstor with __dict__",
+         lambda obj: DictArtstorRecord(obj, options), objs),
+    ]
+    for name, make, items in cases:
+        usec, size = per_record(make, items, args.rounds)
+        print("%-24s %8.3f us/record %8.1f bytes/record" % (name, usec,
+                                                              size))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+# !/usr/bin/env python
+"""Benchmark the analysis and ingest scripts on synthetic corpora.
+
+Generates a corpus from each sample export in Day1/data (kept in the work
+directory and reused on later runs), then times each script mode in a
+fresh process: field statistics, XPath/element extraction, several-query
+tables and --present for both analysis scripts, and addtofedora.py
+writing RDF to disk and against a local stub Fedora server. Each result
+gives records/sec, peak RSS and, for the analysis modes, the time spent
+in each phase. Results are printed and saved as JSON so runs can be
+compared over time.
+"""
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from urllib.request import urlopen
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+DAY1 = os.path.join(ROOT, "Day1", "scripts")
+DATA = os.path.join(ROOT, "Day1", "data")
+DLXS = os.path.join(DAY1, "dlxsexport_analysis.py")
+ARTSTOR = os.path.join(DAY1, "artstor_analysis.py")
+ADDTOFEDORA = os.path.join(ROOT, "Day2", "scripts", "addtofedora.py")
+
+from generate_corpus import generate
+from peakrss import measure
+
+# (name, sample, script, options)
+CASES = [
+    ("hunt_books stats", "hunt_books.xml", DLXS, []),
+    ("hunt_books xpath", "hunt_books.xml", DLXS,
+     ["-x", "FILEDESC/SOURCEDESC/BIBL/AUTHOR"]),
+    ("hunt_books present", "hunt_books.xml", DLXS,
+     ["-p", "-x", "FILEDESC/SOURCEDESC/BIBL/NOTE"]),
+    ("hunt_books table", "hunt_books.xml", DLXS,
+     ["-x", "FILEDESC/SOURCEDESC/BIBL/AUTHOR",
+      "-x", "FILEDESC/SOURCEDESC/BIBL/NOTE",
+      "-x", "FILEDESC/TITLESTMT/TITLE"]),
+    ("chla_journals stats", "chla_journals.xml", DLXS, []),
+    ("chla_journals xpath", "chla_journals.xml", DLXS,
+     ["-x", "FILEDESC/TITLESTMT/TITLE"]),
+    ("labor_photos stats", "labor_photos.json", ARTSTOR, []),
+    ("labor_photos element", "labor_photos.json", ARTSTOR,
+     ["-e", "Photographer.display_value"]),
+    ("labor_photos present", "labor_photos.json", ARTSTOR,
+     ["-p", "-e", "Notes"]),
+    ("labor_photos table", "labor_photos.json", ARTSTOR,
+     ["-e", "Photographer.display_value", "-e", "Title", "-e", "Date"]),
+    ("hiphop_flyers stats", "hiphop_flyers.json", ARTSTOR, []),
+    ("hiphop_flyers element", "hiphop_flyers.json", ARTSTOR,
+     ["-e", "Title"]),
+]
+
+
+def corpus(workdir, sample, records):
+    """Get the path of a synthetic corpus, generating it if needed."""
+    name, ext = os.path.splitext(sample)
+    path = os.path.join(workdir, "%s_%d%s" % (name, records, ext))
+    if not os.path.exists(path):
+        generate(os.path.join(DATA, sample), path + ".tmp", records)
+        os.rename(path + ".tmp", path)
+    return path
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def bench_ingest(workdir, records, concurrency, latency):
+    """Time addtofedora.py against the stub Fedora server."""
+    datafile = corpus(workdir, "hunt_books.xml", records)
+    journal = os.path.join(workdir, "ingest.journal")
+    if os.path.exists(journal):
+        os.remove(journal)
+    port = free_port()
+    server = subprocess.Popen([sys.executable,
+                               os.path.join(HERE, "stub_fedora.py"),
+                               "-p", str(port), "-l", str(latency)])
+    try:
+        base = "http://127.0.0.1:%d/digcoll" % port
+        for attempt in range(50):
+            try:
+                socket.create_connection(("127.0.0.1", port)).close()
+                break
+            except socket.error:
+                time.sleep(0.1)
+        elapsed, peak = measure([ADDTOFEDORA,
+                                 "-b", base, "-j", journal,
+                                 "-c", str(concurrency), datafile])
+        stub = json.loads(urlopen("http://127.0.0.1:%d/" % port).read()
+                          .decode("utf-8"))
+    finally:
+        server.terminate()
+        server.wait()
+        for path in (journal, journal + "-wal", journal + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+    return {"name": "hunt_books ingest", "records": records,
+            "seconds": elapsed, "records_per_sec": records / elapsed,
+            "peak_rss_mb": peak, "phases": {"ingest": elapsed},
+            "requests": stub, "concurrency": concurrency,
+            "latency": latency}
+
+
+def bench_export(workdir, records):
+    """Time addtofedora.py writing gzipped N-Triples shards to disk."""
+    datafile = corpus(workdir, "hunt_books.xml", records)
+    prefix = os.path.join(workdir, "export")
+    try:
+        elapsed, peak = measure([ADDTOFEDORA, "-o", prefix, datafile])
+    finally:
+        for name in os.listdir(workdir):
+            if name.startswith("export-"):
+                os.remove(os.path.join(workdir, name))
+    return {"name": "hunt_books export", "records": records,
+            "seconds": elapsed, "records_per_sec": records / elapsed,
+            "peak_rss_mb": peak, "phases": {"export": elapsed}}
+
+
+def main():
+    parser = ArgumentParser(usage='%(prog)s [options]')
+    parser.add_argument("-n", "--records", dest="records", type=int,
+                        default=100000, help="records per corpus")
+    parser.add_argument("-w", "--workdir", dest="workdir",
+                        default=os.path.join(HERE, "corpus"),
+                        help="where corpora are generated and kept")
+    parser.add_argument("-o", "--output", dest="output",
+                        help="results JSON file (default "
+                             "results-<timestamp>.json)")
+    parser.add_argument("-k", "--match", dest="match",
+                        help="only run cases whose name contains this")
+    parser.add_argument("--ingest-records", dest="ingest_records", type=int,
+                        default=1000, help="records for the ingest run")
+    parser.add_argument("--concurrency", dest="concurrency", type=int,
+                        default=8, help="addtofedora.py concurrency")
+    parser.add_argument("--latency", dest="latency", type=float,
+                        default=0.005, help="stub Fedora seconds/request")
+    parser.add_argument("--no-ingest", action="store_true", dest="no_ingest",
+                        default=False, help="skip the ingest benchmark")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.workdir):
+        os.makedirs(args.workdir)
+    metrics_file = os.path.join(args.workdir, "metrics.json")
+    results = []
+    for name, sample, script, options in CASES:
+        if args.match and args.match not in name:
+            continue
+        datafile = corpus(args.workdir, sample, args.records)
+        elapsed, peak = measure([script] + options +
+                                ["--metrics-file", metrics_file, datafile])
+        with open(metrics_file) as f:
+            result = json.load(f)
+        os.remove(metrics_file)
+        result.update({"name": name, "seconds": elapsed,
+                       "records_per_sec": result["records"] / elapsed,
+                       "peak_rss_mb": peak})
+        results.append(result)
+        print("%-24s %9.0f rec/s %8.1f MB  %s" % (
+            name, result["records_per_sec"], peak,
+            ", ".join("%s %.2fs" % phase
+                      for phase in sorted(result["phases"].items()))))
+
+    if not args.match or args.match in "hunt_books export":
+        result = bench_export(args.workdir, args.records)
+        results.append(result)
+        print("%-24s %9.0f rec/s %8.1f MB" % (
+            result["name"], result["records_per_sec"],
+            result["peak_rss_mb"]))
+
+    if not args.no_ingest and (not args.match or
+                               args.match in "hunt_books ingest"):
+        result = bench_ingest(args.workdir, args.ingest_records,
+                              args.concurrency, args.latency)
+        results.append(result)
+        print("%-24s %9.0f rec/s %8.1f MB  %s" % (
+            result["name"], result["records_per_sec"],
+            result["peak_rss_mb"], result["requests"]))
+
+    output = args.output or "results-%s.json" % time.strftime(
+        "%Y%m%d-%H%M%S")
+    with open(output, "w") as f:
+        json.dump({"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "python": platform.python_version(),
+                   "platform": platform.platform(),
+                   "records": args.records,
+                   "results": results}, f, indent=2, sort_keys=True)
+    print("results saved to %s" % output)
+
+if __name__ == "__main__":
+    main()
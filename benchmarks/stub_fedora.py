@@ -0,0 +1,83 @@
+# !/usr/bin/env python
+"""Minimal stand-in for a Fedora 4 REST API, for ingest benchmarks.
+
+Accepts POST (answering with the new container's URI, built from the
+Slug header), PUT and PATCH, optionally after a fixed delay to mimic
+network and repository latency. GET / returns request counts as JSON.
+Nothing is stored.
+"""
+import json
+import threading
+import time
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0):
+        HTTPServer.__init__(self, address, StubHandler)
+        self.latency = latency
+        self.counts = {}
+        self.lock = threading.Lock()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, status, body=b""):
+        with self.server.lock:
+            self.server.counts[self.command] = \
+                self.server.counts.get(self.command, 0) + 1
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def do_POST(self):
+        self.read_body()
+        uri = "http://%s:%d%s/%s" % (self.server.server_address[0],
+                                     self.server.server_address[1],
+                                     self.path.rstrip("/"),
+                                     self.headers.get("Slug", "x"))
+        self.respond(201, uri.encode("utf-8"))
+
+    def do_PUT(self):
+        self.read_body()
+        self.respond(201)
+
+    def do_PATCH(self):
+        self.read_body()
+        self.respond(204)
+
+    def do_GET(self):
+        with self.server.lock:
+            body = json.dumps(self.server.counts).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = ArgumentParser(usage='%(prog)s [options]')
+    parser.add_argument("-p", "--port", dest="port", type=int, default=8080,
+                        help="port to listen on")
+    parser.add_argument("-l", "--latency", dest="latency", type=float,
+                        default=0.0, help="seconds to wait per request")
+    args = parser.parse_args()
+    StubServer(("127.0.0.1", args.port), args.latency).serve_forever()
+
+if __name__ == "__main__":
+    main()